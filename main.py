@@ -1,7 +1,15 @@
 import asyncio
-import json
+import logging
+import logging.handlers
+import os
+import queue
+from collections import OrderedDict
 from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from urllib.parse import urlsplit
 
+import httpx
+import orjson
 from fastapi import (  # Query is used for more detailed parameter definition
     FastAPI,
     HTTPException,
@@ -12,32 +20,387 @@ from playwright.async_api import (  # For type hinting if needed
     BrowserContext,
     Page,
     Playwright,
+    Request,
+    Response,
+    Route,
     async_playwright,
 )
 from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from pydantic import BaseModel
 
-# Global instances for Playwright and Browser, managed by FastAPI lifespan
+# Log records are handed to a queue and written by a background thread, so
+# request coroutines never block on stdout.
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+logger.propagate = False
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+log_stream_handler = logging.StreamHandler()
+log_stream_handler.setFormatter(
+    logging.Formatter("%(asctime)s %(levelname)s %(message)s")
+)
+log_listener = logging.handlers.QueueListener(log_queue, log_stream_handler)
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36"
+# Number of Chromium instances launched at startup; requests are spread across them
+BROWSER_COUNT = int(os.environ.get("BROWSER_COUNT", "3"))
+# Maximum number of concurrent pages (tabs) per browser instance
+MAX_TABS_PER_BROWSER = int(os.environ.get("MAX_TABS_PER_BROWSER", "25"))
+# Number of browser contexts per browser kept warm for reuse across requests;
+# matches the tab limit so a fully loaded browser never opens throwaway contexts
+POOL_SIZE = int(os.environ.get("POOL_SIZE", str(MAX_TABS_PER_BROWSER)))
+# Contexts created per browser at startup; the rest of the pool fills on demand
+POOL_PREWARM = min(int(os.environ.get("POOL_PREWARM", "4")), POOL_SIZE)
+# Chromium switches that trim per-tab memory and background work
+CHROMIUM_ARGS = [
+    "--no-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--mute-audio",
+    "--no-first-run",
+    "--disable-sync",
+    "--disable-translate",
+    "--renderer-process-limit=2",
+]
+# Purge the V8 heap of a pooled context every N scrapes it serves
+CONTEXT_PURGE_EVERY = int(os.environ.get("CONTEXT_PURGE_EVERY", "50"))
+# Replace a pooled context with a fresh one after this many scrapes
+CONTEXT_MAX_USES = int(os.environ.get("CONTEXT_MAX_USES", "500"))
+# Number of concurrent workers draining a /scrape_bulk request
+BULK_WORKERS = int(os.environ.get("BULK_WORKERS", "8"))
+# Seconds to wait for the target POST once navigation starts
+CAPTURE_TIMEOUT = 30
+# Seconds allowed for a direct HTTP replay of a recorded target POST
+REPLAY_TIMEOUT = float(os.environ.get("REPLAY_TIMEOUT", "10"))
+# Request headers not replayed: the HTTP client sets the transport ones itself,
+# and cookies are session state that every browser scrape deliberately clears
+REPLAY_SKIPPED_HEADERS = {
+    "host",
+    "content-length",
+    "connection",
+    "accept-encoding",
+    "cookie",
+}
+# Seconds a recorded recipe may be replayed before the browser is used again,
+# so signed bodies, timestamps or csrf tokens in it are refreshed
+RECIPE_TTL = float(os.environ.get("RECIPE_TTL", "300"))
+# Maximum number of recorded replay recipes kept in memory
+MAX_RECIPES = int(os.environ.get("MAX_RECIPES", "1000"))
+# Hard limit in seconds on one scrape, including the wait for a free browser tab
+MAX_SCRAPE_SECONDS = float(os.environ.get("MAX_SCRAPE_SECONDS", "75"))
+# Seconds allowed for returning a context to the pool (or closing it) after a scrape
+RELEASE_TIMEOUT = float(os.environ.get("RELEASE_TIMEOUT", "45"))
+# Default Playwright timeouts in seconds for navigations and other page calls
+PAGE_NAVIGATION_TIMEOUT = 30
+PAGE_ACTION_TIMEOUT = 10
+# Seconds between checks that every browser is still connected
+HEALTH_CHECK_INTERVAL = 5
+# Subresources that never carry the target POST; aborted to speed up page loads
+BLOCKED_RESOURCE_TYPES = {"image", "stylesheet", "font", "media"}
+
+
+@dataclass
+class PooledContext:
+    """A reusable browser context, its idle page and the scrapes it has served."""
+
+    context: BrowserContext
+    page: Page
+    java_script_enabled: bool = True
+    uses: int = 0
+
+
+@dataclass
+class BrowserEntry:
+    """A launched browser, its tab limit and its pools of warm contexts."""
+
+    browser: Browser
+    semaphore: asyncio.Semaphore
+    # Keyed by whether JavaScript is enabled in the pooled contexts
+    context_pools: dict[bool, asyncio.Queue]
+    active: int = 0
+
+
+@dataclass
+class ReplayRecipe:
+    """A captured target POST that can be sent again without a browser."""
+
+    url: str
+    headers: dict[str, str]
+    body: bytes | None
+    # Event loop time at which the POST was captured
+    recorded_at: float
+
+
+# Global instances for Playwright and Browsers, managed by FastAPI lifespan
 playwright_manager: Playwright | None = None
-browser_instance: Browser | None = None
+browsers: list[BrowserEntry] = []
+# Shared client for replaying recorded target POSTs, managed by FastAPI lifespan
+http_client: httpx.AsyncClient | None = None
+# Recorded target POSTs keyed by (page_url, target_url_fragment), least
+# recently used first; capped at MAX_RECIPES
+recipes: OrderedDict[tuple[str, str], ReplayRecipe] = OrderedDict()
+# Context releases running after their scrape returned; held so they are not
+# garbage collected mid-flight and can be awaited on shutdown
+release_tasks: set[asyncio.Task] = set()
+# Scrapes currently running, keyed by their parameters, shared by duplicate callers
+in_flight: dict[tuple, asyncio.Task] = {}
+
+
+async def block_heavy_resources(route: Route):
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def new_pooled_context(
+    browser: Browser, java_script_enabled: bool = True
+) -> PooledContext:
+    context = await browser.new_context(
+        user_agent=USER_AGENT, java_script_enabled=java_script_enabled
+    )
+    try:
+        page = await new_idle_page(context)
+    except BaseException:
+        await close_context_quietly(context)
+        raise
+    return PooledContext(context, page, java_script_enabled)
+
+
+async def new_idle_page(context: BrowserContext) -> Page:
+    page = await context.new_page()
+    # Bound every Playwright call on the page so a stuck one cannot pin it
+    page.set_default_navigation_timeout(PAGE_NAVIGATION_TIMEOUT * 1000)
+    page.set_default_timeout(PAGE_ACTION_TIMEOUT * 1000)
+    return page
+
+
+async def abort_route(route: Route):
+    await route.abort()
+
+
+async def checkout_context(
+    entry: BrowserEntry, java_script_enabled: bool = True
+) -> PooledContext:
+    # Reuse a warm context when available, otherwise open an extra one
+    try:
+        return entry.context_pools[java_script_enabled].get_nowait()
+    except asyncio.QueueEmpty:
+        return await new_pooled_context(entry.browser, java_script_enabled)
+
+
+async def purge_js_memory(pooled: PooledContext):
+    # Ask V8 to drop reclaimable heap accumulated by earlier scrapes
+    cdp = await pooled.context.new_cdp_session(pooled.page)
+    await cdp.send("Memory.forciblyPurgeJavaScriptMemory")
+    await cdp.detach()
+
+
+def visited_origins(page: Page, page_url: str) -> set[str]:
+    # Origins whose storage the scrape may have written: the requested page
+    # plus every frame still loaded (covers redirects of the main frame)
+    origins = set()
+    for url in [page_url, *(frame.url for frame in page.frames)]:
+        parts = urlsplit(url)
+        if parts.scheme in ("http", "https") and parts.netloc:
+            origins.add(f"{parts.scheme}://{parts.netloc}")
+    return origins
+
+
+async def clear_origin_storage(pooled: PooledContext, origins: set[str]):
+    # Cookies are cleared separately; this drops local/session storage,
+    # IndexedDB, cache storage and service workers so tokens such as csrf
+    # values do not leak into the next scrape.
+    cdp = await pooled.context.new_cdp_session(pooled.page)
+    try:
+        for origin in origins:
+            await cdp.send(
+                "Storage.clearDataForOrigin",
+                {"origin": origin, "storageTypes": "all"},
+            )
+    finally:
+        await cdp.detach()
+
+
+async def reset_page(pooled: PooledContext, healthy: bool):
+    # Bring the idle page back to a blank state; replace it if that fails
+    if healthy and not pooled.page.is_closed():
+        try:
+            # Blank the page before dropping its routes so the abort/blocking
+            # handlers keep the scraped page from fetching more while it unloads
+            await pooled.page.goto("about:blank")
+            await pooled.page.unroute("**/*")
+            return
+        except Exception as e_reset:
+            logger.warning("Error resetting pooled page: %s", e_reset)
+    if not pooled.page.is_closed():
+        try:
+            await pooled.page.close()
+        except Exception as e_page_close:
+            logger.warning("Error closing page: %s", e_page_close)
+    pooled.page = await new_idle_page(pooled.context)
+
+
+async def release_context(
+    entry: BrowserEntry,
+    pooled: PooledContext,
+    healthy: bool = True,
+    origins: set[str] | None = None,
+):
+    pooled.uses += 1
+    context_pool = entry.context_pools[pooled.java_script_enabled]
+    try:
+        if context_pool.full():
+            # Pool already holds POOL_SIZE warm contexts; skip the reset and
+            # discard the overflow one straight away
+            await pooled.context.close()
+            return
+        if pooled.uses >= CONTEXT_MAX_USES:
+            # Recycle long-lived contexts entirely rather than letting them grow
+            await pooled.context.close()
+            pooled = await new_pooled_context(entry.browser, pooled.java_script_enabled)
+        else:
+            await reset_page(pooled, healthy)
+            if origins:
+                await clear_origin_storage(pooled, origins)
+            if pooled.uses % CONTEXT_PURGE_EVERY == 0:
+                await purge_js_memory(pooled)
+            # Drop cookies so the next request starts from a clean session
+            await pooled.context.clear_cookies()
+        context_pool.put_nowait(pooled)
+    except asyncio.QueueFull:
+        # Another release filled the pool while this context was being reset
+        await pooled.context.close()
+    except BaseException as e_release:
+        # Includes cancellation by RELEASE_TIMEOUT: never leave the context
+        # neither pooled nor closed
+        logger.warning("Error returning context to pool: %r", e_release)
+        await close_context_quietly(pooled.context)
+        if not isinstance(e_release, Exception):
+            raise
+
+
+async def close_context_quietly(context: BrowserContext):
+    try:
+        await asyncio.wait_for(context.close(), timeout=RELEASE_TIMEOUT)
+    except BaseException as e_close:
+        logger.warning("Error closing context: %r", e_close)
+
+
+async def finish_scrape(
+    entry: BrowserEntry,
+    checkout_task: asyncio.Task | None,
+    healthy: bool,
+    page_url: str,
+):
+    # Runs as its own task so the MAX_SCRAPE_SECONDS cap can neither cancel it
+    # halfway (leaking the context) nor wait on it; frees the tab when done.
+    try:
+        if checkout_task is None:
+            return
+        try:
+            pooled = await checkout_task
+        except Exception:
+            return  # No context was created, nothing to hand back
+        # Blanks (or replaces, after an error) the page and clears the storage
+        # of the visited origins before pooling it again
+        await asyncio.wait_for(
+            release_context(
+                entry, pooled, healthy, visited_origins(pooled.page, page_url)
+            ),
+            timeout=RELEASE_TIMEOUT,
+        )
+    except BaseException as e_finish:
+        logger.warning("Error releasing context after scrape: %r", e_finish)
+    finally:
+        entry.semaphore.release()
+
+
+async def launch_browser() -> tuple[Browser, dict[bool, asyncio.Queue]]:
+    browser = await playwright_manager.chromium.launch(
+        headless=True,
+        args=CHROMIUM_ARGS,
+        chromium_sandbox=False,
+        # Shutdown is driven by the FastAPI lifespan, not by Ctrl+C reaching Chromium
+        handle_sigint=False,
+        # slow_mo=500 # Useful for debugging, slows down Playwright operations
+    )
+    # Only POOL_PREWARM JS-enabled contexts are created up front; JS-disabled
+    # ones are opt-in, and both pools fill up to POOL_SIZE on demand.
+    context_pools = {
+        True: asyncio.Queue(maxsize=POOL_SIZE),
+        False: asyncio.Queue(maxsize=POOL_SIZE),
+    }
+    for _ in range(POOL_PREWARM):
+        context_pools[True].put_nowait(await new_pooled_context(browser))
+    return browser, context_pools
+
+
+async def browser_watchdog():
+    # Relaunch any browser whose process crashed or lost its connection
+    while True:
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+        for index, entry in enumerate(browsers):
+            if entry.browser.is_connected():
+                continue
+            logger.warning("Browser %d disconnected, relaunching...", index)
+            try:
+                entry.browser, entry.context_pools = await launch_browser()
+                logger.info("Browser %d relaunched.", index)
+            except Exception as e_launch:
+                logger.error("Error relaunching browser %d: %s", index, e_launch)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global playwright_manager, browser_instance
-    print("[Lifespan] Starting up Playwright...")
+    global playwright_manager, http_client
+    log_listener.start()
+    logger.info("[Lifespan] Starting up Playwright...")
     playwright_manager = await async_playwright().start()
-    browser_instance = await playwright_manager.chromium.launch(
-        # headless=True, # Recommended for production
-        # slow_mo=500 # Useful for debugging, slows down Playwright operations
-    )  # Defaults to headless=False if not specified, matching original debug setup
-    print("[Lifespan] Playwright browser launched.")
+    for _ in range(BROWSER_COUNT):
+        browser, context_pools = await launch_browser()
+        browsers.append(
+            BrowserEntry(
+                browser=browser,
+                semaphore=asyncio.Semaphore(MAX_TABS_PER_BROWSER),
+                context_pools=context_pools,
+            )
+        )
+    logger.info(
+        "[Lifespan] %d Playwright browsers launched "
+        "(%d tabs, %d of %d pooled contexts prewarmed each).",
+        BROWSER_COUNT,
+        MAX_TABS_PER_BROWSER,
+        POOL_PREWARM,
+        POOL_SIZE,
+    )
+    http_client = httpx.AsyncClient(http2=True, timeout=REPLAY_TIMEOUT)
+    watchdog_task = asyncio.create_task(browser_watchdog())
     yield
-    print("[Lifespan] Shutting down Playwright...")
-    if browser_instance:
-        await browser_instance.close()
+    logger.info("[Lifespan] Shutting down Playwright...")
+    watchdog_task.cancel()
+    await asyncio.gather(*release_tasks, return_exceptions=True)
+    await http_client.aclose()
+    http_client = None
+    for entry in browsers:
+        for context_pool in entry.context_pools.values():
+            while not context_pool.empty():
+                try:
+                    await context_pool.get_nowait().context.close()
+                except Exception as e_context_close:
+                    logger.warning("Error closing context: %s", e_context_close)
+        try:
+            await entry.browser.close()
+        except Exception as e_browser_close:
+            logger.warning("Error closing browser: %s", e_browser_close)
+    browsers.clear()
     if playwright_manager:
         await playwright_manager.stop()
-    print("[Lifespan] Playwright shutdown complete.")
+    logger.info("[Lifespan] Playwright shutdown complete.")
+    log_listener.stop()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -47,137 +410,321 @@ app = FastAPI(lifespan=lifespan)
 # captured_post_data = None
 # capture_event = asyncio.Event()  # 用于通知主协程数据已捕获
 
-# Original handle_response - kept for reference, but main_scraper now uses a local inner version
-# to ensure concurrent request safety.
+# Original handle_response - kept for reference, but main_scraper now resolves a
+# per-page future from its own listener to ensure concurrent request safety.
 # async def handle_response(response):
 #     global captured_post_data
 #     # ... (original implementation)
 
 
-async def main_scraper(page_url: str, target_url: str):
-    global browser_instance  # Use the globally managed browser instance
+def connected_browsers() -> list[BrowserEntry]:
+    return [entry for entry in browsers if entry.browser.is_connected()]
 
-    if not browser_instance:
-        print(
-            "[!] Global browser instance not initialized. Ensure FastAPI lifespan event ran."
+
+async def main_scraper(
+    page_url: str,
+    target_url: str,
+    disable_js: bool = False,
+    block_resources: bool = True,
+):
+    available = connected_browsers()
+    if not available:
+        logger.error(
+            "No connected browser instance. Ensure FastAPI lifespan event ran."
         )
         raise HTTPException(status_code=503, detail="Browser service not ready")
 
-    # Local data capture variables for this specific scraping task
-    # Using a mutable dictionary to allow modification in the inner function
-    _local_captured_post_data_holder = {"data": None}
-    _local_capture_event = asyncio.Event()
+    # Route to the least loaded browser; `active` also counts requests still
+    # waiting on the semaphore so queued work is spread evenly.
+    entry = min(available, key=lambda b: b.active)
+    entry.active += 1
 
-    async def handle_response_inner(response):
-        # This inner function is a closure, accessing _local_captured_post_data_holder
-        # and _local_capture_event from the outer main_scraper scope.
-        is_target_post = (
-            target_url in response.url and response.request.method == "POST"
+    try:
+        # The cap covers waiting for a free tab as well as the scrape itself, so
+        # queued clients cannot hang either. Returning the context to the pool
+        # happens in a separate task that the cap does not cancel.
+        return await asyncio.wait_for(
+            scrape_on_browser(entry, page_url, target_url, disable_js, block_resources),
+            timeout=MAX_SCRAPE_SECONDS,
+        )
+    except asyncio.TimeoutError:
+        logger.error(
+            "Scrape of %s exceeded %s seconds and was cancelled.",
+            page_url,
+            MAX_SCRAPE_SECONDS,
         )
+        return None
+    finally:
+        entry.active -= 1
+
+
+async def coalesced_scraper(
+    page_url: str,
+    target_url: str,
+    disable_js: bool = False,
+    block_resources: bool = True,
+):
+    # Identical concurrent requests await the same scrape instead of each
+    # loading the page again.
+    key = (page_url, target_url, disable_js, block_resources)
+    task = in_flight.get(key)
+    if task is None:
+        task = asyncio.create_task(
+            main_scraper(page_url, target_url, disable_js, block_resources)
+        )
+        in_flight[key] = task
+        task.add_done_callback(lambda _: in_flight.pop(key, None))
+    else:
+        logger.info("Joining in-flight scrape for: %s", page_url)
+    # Shielded so one caller disconnecting does not cancel it for the others
+    return await asyncio.shield(task)
+
+
+async def record_recipe(key: tuple[str, str], request: Request):
+    headers = {
+        name: value
+        for name, value in (await request.all_headers()).items()
+        if not name.startswith(":") and name not in REPLAY_SKIPPED_HEADERS
+    }
+    recipes[key] = ReplayRecipe(
+        request.url,
+        headers,
+        request.post_data_buffer,
+        asyncio.get_running_loop().time(),
+    )
+    while len(recipes) > MAX_RECIPES:
+        recipes.popitem(last=False)
+    logger.info("Recorded replay recipe for: %s", request.url)
+
+
+def discard_recipe(key: tuple[str, str], recipe: ReplayRecipe):
+    # A browser scrape may have recorded a fresh recipe meanwhile; keep that one
+    if recipes.get(key) is recipe:
+        del recipes[key]
+
+
+async def replay_recipe(key: tuple[str, str]):
+    recipe = recipes.get(key)
+    if recipe is None or http_client is None:
+        return None
+    if asyncio.get_running_loop().time() - recipe.recorded_at > RECIPE_TTL:
+        logger.info("Replay recipe for %s expired, using browser", recipe.url)
+        discard_recipe(key, recipe)
+        return None
+    recipes.move_to_end(key)
+    try:
+        response = await http_client.post(
+            recipe.url, headers=recipe.headers, content=recipe.body
+        )
+        response.raise_for_status()
+        data = orjson.loads(response.content)
+    except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+        # Expired signature, auth rejected or changed payload: use the browser
+        logger.info("Replay of %s failed, falling back to browser: %s", recipe.url, e)
+        discard_recipe(key, recipe)
+        return None
+    logger.info("Data captured via replay of: %s", recipe.url)
+    return data
+
+
+async def fast_path_scraper(
+    page_url: str,
+    target_url: str,
+    disable_js: bool = False,
+    block_resources: bool = True,
+    fast_path: bool = True,
+):
+    # Try replaying a previously captured POST before loading the page
+    if fast_path:
+        data = await replay_recipe((page_url, target_url))
+        if data is not None:
+            return data
+    return await coalesced_scraper(page_url, target_url, disable_js, block_resources)
+
 
-        if is_target_post:
-            print(f"[*] Intercepted POST response from: {response.url}")
+async def read_response_data(
+    response: Response, recipe_key: tuple[str, str] | None = None
+):
+    logger.info("Intercepted POST response from: %s", response.url)
+    try:
+        # Buffer the body once and parse it locally instead of json() then text().
+        # A raw CDP Network.getResponseBody would not be cheaper: Playwright
+        # CDP sessions are tunnelled through the same driver connection, so
+        # this is already a single round trip to Chromium.
+        body = await response.body()
+    except Exception as e_body:
+        logger.error("Error getting response body: %s", e_body)
+        return {"error": str(e_body)}
+    try:
+        data = orjson.loads(body)
+        logger.info("Data captured")
+        if recipe_key is not None and recipe_key not in recipes:
+            # Recording is only a cache for later scrapes; never fail this one
             try:
-                data = await response.json()
-                _local_captured_post_data_holder["data"] = data
-                print("[*] Data captured (local)")
-                _local_capture_event.set()  # Notify main_scraper data is captured
-            except Exception as e:
-                print(f"[!] Error parsing response data from {response.url}: {e}")
-                try:
-                    text_data = await response.text()
-                    print(
-                        f"[!] Response text: {text_data[:500]}...  status: {response.status}"
-                    )
-                    _local_captured_post_data_holder["data"] = {
-                        "error": str(e),
-                        "raw_text": text_data,
-                    }
-
-                    request = response.request
-                    print(f"    [DEBUG] Failed Request URL: {request.url}")
-                    print(f"    [DEBUG] Failed Request Method: {request.method}")
-                    request_headers_str = json.dumps(
-                        await request.all_headers(), indent=2, ensure_ascii=False
-                    )
-                    print(f"    [DEBUG] Failed Request Headers: {request_headers_str}")
-                except Exception as e_text:
-                    print(f"[!] Error getting text response: {e_text}")
-                    _local_captured_post_data_holder["data"] = {"error": str(e_text)}
-                finally:
-                    # Original code had a commented out capture_event.set() here.
-                    # Current logic: event is set only on successful .json() parsing.
-                    # If .json() fails, data is still stored in _local_captured_post_data_holder,
-                    # and main_scraper will retrieve it after its own timeout.
-                    # 这里有的网站会发 2 次请求, 第 1 次请求 405 因为此时 csrf-token 为 null
-                    pass
-
-    context: BrowserContext | None = None
+                await record_recipe(recipe_key, response.request)
+            except Exception as e_recipe:
+                logger.warning("Error recording replay recipe: %s", e_recipe)
+        return data
+    except orjson.JSONDecodeError as e:
+        logger.warning("Error parsing response data from %s: %s", response.url, e)
+        text_data = body.decode(errors="replace")
+        logger.warning(
+            "Response text: %s...  status: %s", text_data[:500], response.status
+        )
+
+        await log_failed_request(response.request)
+        return {"error": str(e), "raw_text": text_data, "status": response.status}
+
+
+async def log_failed_request(request: Request):
+    # Fetching all headers costs a round trip to the browser; only do it
+    # when the debug output will actually be emitted.
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Failed Request URL: %s", request.url)
+        logger.debug("Failed Request Method: %s", request.method)
+        request_headers_str = orjson.dumps(
+            await request.all_headers(), option=orjson.OPT_INDENT_2
+        ).decode()
+        logger.debug("Failed Request Headers: %s", request_headers_str)
+
+
+async def read_failed_response(response: Response):
+    # No successful target POST arrived; report the last failed one instead
+    try:
+        text_data = (await response.body()).decode(errors="replace")
+    except Exception as e_body:
+        logger.error("Error getting response body: %s", e_body)
+        text_data = ""
+    await log_failed_request(response.request)
+    return {
+        "error": f"Target POST failed with status {response.status}",
+        "raw_text": text_data,
+        "status": response.status,
+    }
+
+
+async def scrape_on_browser(
+    entry: BrowserEntry,
+    page_url: str,
+    target_url: str,
+    disable_js: bool = False,
+    block_resources: bool = True,
+):
+    captured: asyncio.Future = asyncio.get_running_loop().create_future()
+    failed_response: Response | None = None
+
+    def on_response(response: Response):
+        nonlocal failed_response
+        # Cheapest checks first: most responses are GETs and are rejected
+        # before the URL is scanned.
+        if (
+            response.request.method != "POST"
+            or captured.done()
+            or target_url not in response.url
+        ):
+            return
+        if not response.ok:
+            # 这里有的网站会发 2 次请求, 第 1 次请求 405 因为此时 csrf-token 为 null,
+            # so keep listening for the retry but remember the failure in case
+            # no successful POST follows.
+            logger.warning(
+                "Target POST to %s failed with status %s, waiting for a retry.",
+                response.url,
+                response.status,
+            )
+            failed_response = response
+            return
+        captured.set_result(response)
+        # Stop dispatching the rest of the page's responses to Python
+        stop_listening()
+
+    listening = False
+
+    def stop_listening():
+        nonlocal listening
+        if listening:
+            listening = False
+            page.remove_listener("response", on_response)
+
     page: Page | None = None
+    checkout_task: asyncio.Task | None = None
+    healthy = True
+    # Held until finish_scrape has returned the context to the pool
+    await entry.semaphore.acquire()
     try:
-        # Create a new context and page for each request for isolation
-        context = await browser_instance.new_context(
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36"
+        # Check out a warm context with its idle page from the pool. Shielded so
+        # a context still being created when the cap fires is handed to
+        # finish_scrape instead of being leaked.
+        checkout_task = asyncio.create_task(
+            checkout_context(entry, java_script_enabled=not disable_js)
         )
-        page = await context.new_page()
+        pooled = await asyncio.shield(checkout_task)
+        page = pooled.page
 
-        # Register response interceptor for this specific page
-        page.on("response", handle_response_inner)
+        if block_resources:
+            # Skip images, styles, fonts and media; the scrape only needs the target POST
+            await page.route("**/*", block_heavy_resources)
+        page.on("response", on_response)
+        listening = True
 
-        print(f"[*] Navigating to {page_url}...")
+        logger.info("Navigating to %s...", page_url)
+        # Return as soon as the target POST is captured instead of waiting for
+        # the page to go network-idle; navigation only needs to start.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + CAPTURE_TIMEOUT
         try:
-            # Open page and wait for network activity to settle
             await page.goto(
-                page_url, wait_until="networkidle", timeout=60000
-            )  # 60-second timeout
-            print("[*] Page loaded, waiting for target POST request...")
-            # Small delay, as in original code, possibly to allow scripts to run
-            await page.wait_for_timeout(1000)
-        except PlaywrightTimeoutError:
-            print(
-                "[!] Page navigation or networkidle timeout. The POST might have already occurred or not at all."
+                page_url, wait_until="commit", timeout=CAPTURE_TIMEOUT * 1000
             )
-            # Proceed to wait for capture_event, as data might have been captured if POST occurred early
+            logger.info("Navigation committed, waiting for target POST request...")
+        except PlaywrightTimeoutError:
+            # The POST might still arrive; keep waiting on the capture
+            logger.warning("Page navigation timeout.")
         except Exception as e:
-            print(f"[!] Error during page navigation: {e}")
+            logger.error("Error during page navigation: %s", e)
             # If navigation fails critically, unlikely to capture data.
-            # The finally block will clean up page/context.
+            # The finally block will reset the page and return the context.
             return None
 
-        # Wait for handle_response_inner to capture data or timeout
         try:
-            # Using the local event for this specific scrape task
-            await asyncio.wait_for(_local_capture_event.wait(), timeout=10.0)
+            response = await asyncio.wait_for(
+                captured, timeout=max(deadline - loop.time(), 0)
+            )
         except asyncio.TimeoutError:
-            print("[!] Timed out waiting for the target POST request to be captured.")
-            # Even on timeout, check if data was captured (e.g., if .json() failed but error data was stored)
-            if _local_captured_post_data_holder["data"]:
-                print(
-                    "[!] Data was captured (or error info stored) before timeout, proceeding."
-                )
-            else:
-                print("[!] No data captured after timeout.")
+            logger.warning(
+                "Timed out waiting for the target POST request to be captured."
+            )
+            if failed_response is not None:
+                return await read_failed_response(failed_response)
+            return None
 
-        return _local_captured_post_data_holder["data"]
+        # We have what we came for: abort everything the page still requests
+        # while the body is read; the page is blanked when it goes back to the pool.
+        await page.route("**/*", abort_route)
+        return await read_response_data(response, (page_url, target_url))
 
+    except asyncio.CancelledError:
+        # Cancelled by the MAX_SCRAPE_SECONDS cap: the page may be hung, so have
+        # it closed and replaced rather than reset with another navigation.
+        healthy = False
+        raise
     except Exception as e_outer:
-        # Catch any other unexpected errors during the main_scraper process
-        print(f"[!!] An unexpected error occurred in main_scraper: {e_outer}")
-        # Consider logging traceback here: import traceback; traceback.print_exc()
+        # Catch any other unexpected errors during the scrape_on_browser process
+        logger.exception(
+            "An unexpected error occurred in scrape_on_browser: %s", e_outer
+        )
+        healthy = False
         return None  # Or raise HTTPException(status_code=500, detail=f"Scraping error: {e_outer}")
     finally:
-        # Ensure page and context are closed for this specific request
-        if page and not page.is_closed():
-            try:
-                await page.close()
-            except Exception as e_page_close:
-                print(f"[!] Error closing page: {e_page_close}")
-        if context:
-            try:
-                await context.close()
-            except Exception as e_context_close:
-                print(f"[!] Error closing context: {e_context_close}")
-        # The global browser_instance remains open, managed by lifespan.
+        stop_listening()
+        # Release in the background: the caller gets its data now, and a
+        # cancelled scrape cannot interrupt the release.
+        release_task = asyncio.create_task(
+            finish_scrape(entry, checkout_task, healthy, page_url)
+        )
+        release_tasks.add(release_task)
+        release_task.add_done_callback(release_tasks.discard)
+        # The global browsers and pooled contexts remain open, managed by lifespan.
 
 
 @app.get("/scrape")
@@ -190,20 +737,39 @@ async def trigger_scrape_endpoint(
         title="Target URL Fragment",
         description="A unique fragment of the target POST request URL.",
     ),
+    disable_js: bool = Query(
+        False,
+        title="Disable JavaScript",
+        description="Load the page with JavaScript disabled, for sites whose target POST does not need scripts.",
+    ),
+    block_resources: bool = Query(
+        True,
+        title="Block Resources",
+        description="Abort image, stylesheet, font and media requests while loading the page.",
+    ),
+    fast_path: bool = Query(
+        True,
+        title="Fast Path",
+        description="Replay a previously captured target POST over HTTP before falling back to the browser.",
+    ),
 ):
-    print(
-        f"Initiating scrape for: {page_url}, looking for POST containing: {target_url_fragment}"
+    logger.info(
+        "Initiating scrape for: %s, looking for POST containing: %s",
+        page_url,
+        target_url_fragment,
+    )
+    data = await fast_path_scraper(
+        page_url, target_url_fragment, disable_js, block_resources, fast_path
     )
-    data = await main_scraper(page_url, target_url_fragment)
 
     if data:
         return data
     else:
         # This part of the original code is slightly ambiguous.
-        # If main_scraper returns None due to an internal error, it prints a message.
+        # If scrape_on_browser returns None due to an internal error, it logs a message.
         # If it returns None because no specific data was found but no error,
         # it might also lead here. The detail message is generic.
-        print(
+        logger.info(
             "Scraping process completed. Data may or may not have been captured. Check logs."
         )
         # Changed the HTTPException detail to be more informative if data is None.
@@ -216,6 +782,56 @@ async def trigger_scrape_endpoint(
         )
 
 
+class ScrapeItem(BaseModel):
+    page_url: str
+    target_url_fragment: str
+    disable_js: bool = False
+    block_resources: bool = True
+    fast_path: bool = True
+
+
+@app.post("/scrape_bulk")
+async def trigger_bulk_scrape_endpoint(items: list[ScrapeItem]):
+    if not connected_browsers():
+        raise HTTPException(status_code=503, detail="Browser service not ready")
+    logger.info("Initiating bulk scrape of %d pages", len(items))
+
+    work_queue: asyncio.Queue = asyncio.Queue()
+    for index, item in enumerate(items):
+        work_queue.put_nowait((index, item))
+    results: dict[int, object] = {}
+
+    async def worker():
+        # Each worker pulls the next item as soon as its previous scrape finishes,
+        # keeping the browser pool busy up to its tab limits.
+        while True:
+            try:
+                index, item = work_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                results[index] = await fast_path_scraper(
+                    item.page_url,
+                    item.target_url_fragment,
+                    item.disable_js,
+                    item.block_resources,
+                    item.fast_path,
+                )
+            except HTTPException as e:
+                results[index] = {"error": e.detail}
+
+    await asyncio.gather(*(worker() for _ in range(min(BULK_WORKERS, len(items)))))
+    return [results.get(index) for index in range(len(items))]
+
+
+@app.get("/health")
+async def health():
+    available = connected_browsers()
+    if not available:
+        raise HTTPException(status_code=503, detail="Browser service not ready")
+    return {"browsers": len(browsers), "connected": len(available)}
+
+
 @app.get("/")
 async def root():
     return {
@@ -226,7 +842,16 @@ async def root():
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # uvloop/httptools come with uvicorn[standard]. Keep a single worker: the
+    # Playwright browsers and context pools live in this process.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=1,
+    )
     # Example for local debugging:
     # uvicorn your_module_name:app --host 0.0.0.0 --port 8000 --reload
     # Then access: http://localhost:8000/scrape?page_url=YOUR_URL&target_url_fragment=YOUR_FRAGMENT